@@ -20,7 +20,7 @@ from google.cloud import storage
 from glob import glob
 from firecloud import api as fapi
 from vrs_anvil import query_metakb
-from vrs_anvil.annotator import MATCHES, TOTAL, VRS_OBJECT
+from vrs_anvil.annotator import MATCHES_FILE, TOTAL, VRS_OBJECT
 
 # data source
 SOURCE_BUCKET = os.getenv("WORKSPACE_BUCKET").split("//")[1]
@@ -48,12 +48,23 @@ def truncate(s, first_few, last_few):
     return f"{s[:first_few]}...{s[-last_few:]}"
 
 
-# get all metrics file blobs
+def load_matches(metrics, metrics_dir):
+    "group a run's metakb matches by vcf, the matches file is read from next to the metrics file"
+    matches = defaultdict(list)
+    matches_file = os.path.basename(metrics[TOTAL][MATCHES_FILE])
+    with open(f"{metrics_dir}/{matches_file}", "r") as file:
+        for line in file:
+            match = json.loads(line)
+            matches[match["file_name"]].append(match)
+    return matches
+
+
+# get all metrics and matches file blobs
 client = storage.Client()
 source_bucket = client.get_bucket(SOURCE_BUCKET)
 all_blobs = source_bucket.list_blobs(prefix=BUCKET_DIR)
-blobs = [blob for blob in all_blobs if blob.name.endswith(".yaml")]
-print("number of metrics files:", len(blobs))
+blobs = [blob for blob in all_blobs if blob.name.endswith((".yaml", ".jsonl"))]
+print("number of metrics and matches files:", len(blobs))
 
 # download blobs to file if not already downloaded
 print(f"downloading to {METRICS_DIR}:")
@@ -136,6 +147,7 @@ for metrics_path in all_metrics_paths:
 
     with open(metrics_path, "r") as file:
         metrics = yaml.safe_load(file)
+    run_matches = load_matches(metrics, METRICS_DIR)
 
     # for each file in the metrics, add matches to dict
     for file_path, metrics_dict in metrics.items():
@@ -152,16 +164,19 @@ for metrics_path in all_metrics_paths:
 
         # check if matches to metakb cache found
         print("from file", truncate(original_path, 0, 46))
-        if MATCHES in metrics_dict:
+        file_matches = run_matches.get(file_path)
+        if file_matches:
             expected_matches = int(metrics_dict["metakb_hits"])
-            actual_matches = len(metrics_dict[MATCHES])
+            actual_matches = len(file_matches)
             assert (
                 expected_matches == actual_matches
             ), f"expected {expected_matches} metakb matches, found {actual_matches}"
             print(f"{actual_matches} matches found")
 
             total_matches += actual_matches
-            matches_per_file.update({original_path: metrics_dict[MATCHES]})
+            matches_per_file.update(
+                {original_path: {_["allele_id"]: _ for _ in file_matches}}
+            )
         else:
             print("no matches from this file")
         print()
@@ -301,7 +316,7 @@ for file_path, matches in matches_per_file.items():
         sample_dict = defaultdict(list)
 
         # extract coordinate information
-        gnomad_expr = allele_info["parameters"]["var"]
+        gnomad_expr = allele_info["var"]
         chrom, pos, ref, alt = gnomad_expr.split("-")
         pos = int(pos)
         print(f"\tgnomad: {gnomad_expr}")
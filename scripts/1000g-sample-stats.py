@@ -29,7 +29,7 @@ import yaml
 from collections import defaultdict
 from glob import glob
 from vrs_anvil import query_metakb
-from vrs_anvil.annotator import MATCHES, TOTAL, VRS_OBJECT
+from vrs_anvil.annotator import MATCHES_FILE, TOTAL, VRS_OBJECT
 
 # grabs all metrics files from this directory
 metrics_dir = "../tests/fixtures/chr1_metrics"
@@ -55,6 +55,17 @@ def truncate(s, first_few, last_few):
     return f"{s[:first_few]}...{s[-last_few:]}"
 
 
+def load_matches(metrics, metrics_dir):
+    "group a run's metakb matches by vcf, the matches file is read from next to the metrics file"
+    matches = defaultdict(list)
+    matches_file = os.path.basename(metrics[TOTAL][MATCHES_FILE])
+    with open(f"{metrics_dir}/{matches_file}", "r") as file:
+        for line in file:
+            match = json.loads(line)
+            matches[match["file_name"]].append(match)
+    return matches
+
+
 def create_caf_dict(
     allele_id,
     gnomad_expression,
@@ -106,6 +117,7 @@ all_metrics_paths = glob(f"{metrics_dir}/metrics*.yaml")
 for metrics_path in all_metrics_paths:
     with open(metrics_path, "r") as file:
         metrics = yaml.safe_load(file)
+    run_matches = load_matches(metrics, metrics_dir)
 
     for file_path in metrics:
         if file_path == TOTAL:
@@ -121,9 +133,12 @@ for metrics_path in all_metrics_paths:
 
         # check if matches to metakb cache found
         print("from file", truncate(original_path, 0, 46))
-        if MATCHES in metrics[file_path]:
-            print(f"{len(metrics[file_path][MATCHES])} hits found")
-            matches_per_file.update({original_path: metrics[file_path][MATCHES]})
+        file_matches = run_matches.get(file_path)
+        if file_matches:
+            print(f"{len(file_matches)} hits found")
+            matches_per_file.update(
+                {original_path: {_["allele_id"]: _ for _ in file_matches}}
+            )
         else:
             print("no evidence from this file")
         print()
@@ -137,7 +152,7 @@ for file_path, evidence in matches_per_file.items():
     for allele_id, allele_info in evidence.items():
 
         # extract coordinate information
-        gnomad_expr = allele_info["parameters"]["var"]
+        gnomad_expr = allele_info["var"]
         chrom, pos, ref, alt = gnomad_expr.split("-")
         pos = int(pos)
         print(f"\tgnomad: {gnomad_expr}")
@@ -232,7 +247,7 @@ for file_path, evidence in matches_per_file.items():
         caf_dict = create_caf_dict(
             allele_id,
             gnomad_expr,
-            allele_info[VRS_OBJECT],
+            allele_info[VRS_OBJECT] if VRS_OBJECT in allele_info else allele_id,
             focus_allele_count,
             locus_allele_count,
             metakb_response,
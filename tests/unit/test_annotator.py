@@ -4,7 +4,10 @@ from typing import Generator
 
 import pytest
 
+import vrs_anvil
 from tests.unit import validate_threaded_result
+from unittest.mock import MagicMock, patch
+from vrs_anvil import CachingAlleleTranslator, _cache_key
 from vrs_anvil.translator import VCFItem
 
 # see https://github.com/ga4gh/vrs-python/blob/main/tests/extras/test_allele_translator.py#L17
@@ -167,6 +170,25 @@ def test_results(caching_translator):
         )
 
 
+def test_translate_from_many(caching_translator):
+    """Ensure batch translation returns the same ids as single translation, in input order."""
+    tlr = caching_translator
+    assert tlr is not None
+    tlr.normalize = False
+
+    all_inputs = [duplication_inputs, snv_inputs, deletion_inputs, insertion_inputs]
+    gnomad_exprs = [inputs["gnomad"] for inputs in all_inputs]
+
+    allele_ids = tlr.translate_from_many(gnomad_exprs, fmt="gnomad")
+
+    assert allele_ids == [
+        duplication_output["id"],
+        snv_output["id"],
+        gnomad_deletion_output["id"],
+        gnomad_insertion_output["id"],
+    ], f"batch results out of order or incorrect: {allele_ids}"
+
+
 def test_cache(caching_translator):
     """Ensure that results from getting allele IDs are faster the second time."""
     tlr = caching_translator
@@ -190,6 +212,64 @@ def test_cache(caching_translator):
     ), f"Cache should make things significantly faster first {noncached_time} second {cache_time}."
 
 
+@pytest.fixture
+def cached_manifest(testing_manifest, monkeypatch):
+    """Set a manifest with the allele cache enabled in a temporary directory."""
+    manifest = testing_manifest.model_copy(update={"cache_enabled": True})
+    monkeypatch.setattr(vrs_anvil, "manifest", manifest)
+    return manifest
+
+
+def test_memory_cache_hit_skips_disk(cached_manifest):
+    """Ensure a variant in the in process LRU is not read from the disk cache or translated again."""
+    tlr = CachingAlleleTranslator(MagicMock())
+    with patch.object(
+        tlr, "_translate_uncached", return_value="ga4gh:VA.test"
+    ) as uncached:
+        assert tlr.translate_from(snv_inputs["gnomad"], fmt="gnomad") == "ga4gh:VA.test"
+        tlr._cache = MagicMock()
+        assert tlr.translate_from(snv_inputs["gnomad"], fmt="gnomad") == "ga4gh:VA.test"
+
+    uncached.assert_called_once()
+    tlr._cache.get.assert_not_called()
+
+
+def test_memory_cache_eviction(cached_manifest, monkeypatch):
+    """Ensure the least recently used id is evicted at the size limit and then read from the disk cache."""
+    monkeypatch.setattr(vrs_anvil, "memory_cache_size", 2)
+    tlr = CachingAlleleTranslator(MagicMock())
+    variants = [
+        snv_inputs["gnomad"],
+        deletion_inputs["gnomad"],
+        insertion_inputs["gnomad"],
+    ]
+    with patch.object(
+        tlr, "_translate_uncached", side_effect=lambda var, fmt=None: f"id:{var}"
+    ) as uncached:
+        for var in variants:
+            tlr.translate_from(var, fmt="gnomad")
+        assert list(tlr._memory_cache) == [
+            _cache_key(var, "gnomad") for var in variants[1:]
+        ], "oldest id should have been evicted"
+
+        assert tlr.translate_from(variants[0], fmt="gnomad") == f"id:{variants[0]}"
+
+    assert uncached.call_count == len(
+        variants
+    ), "evicted id should come from the disk cache"
+    assert _cache_key(variants[0], "gnomad") in tlr._memory_cache
+
+
+def test_cache_disabled(testing_manifest, monkeypatch):
+    """Ensure translate_from skips the caches when the cache is disabled."""
+    monkeypatch.setattr(vrs_anvil, "manifest", testing_manifest)
+    assert not testing_manifest.cache_enabled
+    tlr = CachingAlleleTranslator(MagicMock())
+
+    assert tlr._cache is None
+    assert tlr.translate_from == tlr._translate_uncached
+
+
 @pytest.fixture()
 def num_threads():
     """Return the number of threads to use for testing."""
@@ -130,7 +130,7 @@ def test_annotate_scatter(mock_cli_manifest):
 
     # make sure scattered processes and log files
     work_dir = str(Path(manifest.work_directory))
-    process_files = len(glob(f"{work_dir}/*scattered_process*.yaml"))
+    process_files = len(glob(f"{work_dir}/*scattered_process*.json"))
     assert process_files == 1, f"expected 1 scattered process file, got {process_files}"
 
     state_dir = str(Path(manifest.state_directory))
@@ -164,3 +164,17 @@ def test_ps_returns_recent_files(ps_dir, monkeypatch, recent_timestamp, num_vcfs
         assert (
             f"metrics_scattered_{recent_timestamp}_{i}.yaml" in result.output
         ), f"metrics file #{i} of {num_vcfs} not found"
+
+
+def test_ps_prefers_json(ps_dir, monkeypatch):
+    """Test that vrs_anvil ps reads the json file when a yaml file has the same timestamp"""
+
+    runner = CliRunner()
+    monkeypatch.chdir(ps_dir)
+
+    result = runner.invoke(cli, "--manifest manifest.yaml ps")
+    print(result.output)
+
+    assert result.exit_code == 0, f"result failed with message: \n{result}"
+    assert "pid: 4430" in result.output, "json process file not chosen"
+    assert "pid: 4420" not in result.output, "yaml process file chosen over json"
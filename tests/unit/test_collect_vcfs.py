@@ -1,8 +1,10 @@
+import errno
+import os
 import time
 
 import pytest
 from unittest.mock import patch, MagicMock
-from vrs_anvil.collector import collect_manifest_urls
+from vrs_anvil.collector import collect_manifest_urls, create_symlink_to_work_directory
 
 
 @pytest.fixture
@@ -50,3 +52,21 @@ def test_collect_manifest_urls(
         "work/file3.vcf",
         "work/file4.vcf",
     ]
+
+
+def test_symlink_falls_back_to_copy(tmp_path):
+    """A vcf is copied only when the file system does not support symlinks."""
+    vcf_file = tmp_path / "file.vcf"
+    vcf_file.write_text("##fileformat=VCFv4.2\n")
+    work_directory = tmp_path / "work"
+    work_directory.mkdir()
+
+    with patch("os.symlink", side_effect=OSError(errno.EPERM, "not supported")):
+        copied = create_symlink_to_work_directory(str(work_directory), str(vcf_file))
+    assert open(copied).read() == vcf_file.read_text(), "vcf should have been copied"
+
+    os.unlink(copied)
+    with patch("os.symlink", side_effect=OSError(errno.ENOSPC, "no space")):
+        with pytest.raises(OSError):
+            create_symlink_to_work_directory(str(work_directory), str(vcf_file))
+    assert not os.path.exists(copied), "vcf should not be copied on other errors"
@@ -1,10 +1,16 @@
 import logging
 import pathlib
+import threading
 from typing import Generator
 
 import pytest
 
-from vrs_anvil.translator import threaded_translator, VCFItem
+from vrs_anvil.translator import (
+    inline_translator,
+    pooled_translator,
+    threaded_translator,
+    VCFItem,
+)
 
 _logger = logging.getLogger("vrs_anvil.test_translator")
 
@@ -59,3 +65,47 @@ def test_threaded_translator(gnomad_csv):
 
     if limit:
         assert c == limit, "did not get the expected number of results"
+
+
+def test_pooled_translator(gnomad_csv):
+    """Ensure the process pool returns a result per item."""
+
+    limit = 2000
+    num_workers = 4
+
+    results = pooled_translator(gnomad_ids(gnomad_csv, limit=limit), num_workers)
+
+    c = 0
+    for _ in results:
+        assert isinstance(_, VCFItem), "should get a VRS id"
+        assert _.result is not None, "allele.id is None"
+        c += 1
+
+    assert c == limit, "did not get the expected number of results"
+
+
+def test_pooled_translator_closed_early(gnomad_csv):
+    """Ensure closing the process pool generator after the first result returns rather than hangs."""
+
+    results = pooled_translator(gnomad_ids(gnomad_csv), 4)
+    assert isinstance(next(results), VCFItem), "should get a VRS id"
+
+    closer = threading.Thread(target=results.close, daemon=True)
+    closer.start()
+    closer.join(timeout=60)
+    assert not closer.is_alive(), "closing the generator did not return"
+
+
+def test_translation_errors():
+    """Ensure a variant that can not be translated is returned with an error, not raised."""
+
+    items = [
+        VCFItem("gnomad", "19-44908822-C-T"),
+        VCFItem("gnomad", "not-a-gnomad-id"),
+    ]
+
+    results = list(inline_translator(iter(items)))
+
+    assert len(results) == 2, "should get a result per item"
+    assert results[0].result is not None and results[0].error is None
+    assert results[1].result is None and results[1].error is not None
@@ -1,4 +1,5 @@
 from vrs_anvil import generate_gnomad_ids
+from vrs_anvil.annotator import _iter_lines_chunked
 
 
 def test_generate_gnomad_ids(caching_translator):
@@ -20,3 +21,12 @@ def test_generate_gnomad_ids(caching_translator):
     print(errors)
     assert len(results) >= 12, f"Errors: {len(errors)} Successes: {len(results)}"
     # TODO confirm these are expected errors ? see https://github.com/ohsu-comp-bio/vrs-python-testing/issues/16
+
+
+def test_iter_lines_chunked():
+    """Lines read in small chunks match the lines of the file."""
+    input_vcf = "tests/fixtures/test_vcf_input.vcf"
+    with open(input_vcf, "rb") as f:
+        expected = f.read().splitlines()
+    with open(input_vcf, "rb") as f:
+        assert list(_iter_lines_chunked(f, chunk_size=7)) == expected
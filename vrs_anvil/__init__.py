@@ -1,9 +1,13 @@
-import json
+import functools
+import itertools
 import logging
 import os
+import re
 import subprocess
-from typing import Optional, Generator, Any
+from typing import Optional, Generator, Any, Literal
 import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 import psutil
 from biocommons.seqrepo import SeqRepo
@@ -12,8 +16,8 @@ from ga4gh.vrs import models as VRS
 from ga4gh.vrs.dataproxy import SeqRepoDataProxy
 from ga4gh.vrs.extras.translator import AlleleTranslator
 from pathlib import Path
-from glom import glom
 from pydantic import BaseModel, model_validator
+import orjson
 import requests
 import yaml
 
@@ -22,6 +26,15 @@ _logger = logging.getLogger("vrs_anvil")
 LOGGED_ALREADY = set()
 METAKB_API = "https://dev-search.cancervariants.org/api/v2"
 
+# libyaml's C parser and emitter when PyYAML was built with it, several times faster than the pure python ones
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+YamlDumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+# TODO - Should this be a config in the manifest?
+# ['<INS>', '<DEL>', '<DUP>', '<INV>', '<CNV>', '<DUP:TANDEM>', '<DUP:INT>', '<DUP:EXT>', '*']
+INVALID_ALTS = re.compile(r"INS|DEL|DUP|INV|CNV|TANDEM|INT|EXT|\*")
+"""Alternate alleles containing any of these can not be translated, matched in a single pass"""
+
 
 manifest: "Manifest" = None
 
@@ -29,10 +42,17 @@ manifest: "Manifest" = None
 gigabytes = 20
 bytes_in_a_gigabyte = 1024**3  # 1 gigabyte = 1024^3 bytes
 cache_size_limit = gigabytes * bytes_in_a_gigabyte
+memory_cache_size = 200_000  # allele ids kept in process, in front of the disk cache
+cache_mmap_size = 1024**3  # 1 GiB of the allele cache's sqlite file read through mmap
+vcf_read_buffer_size = 8 * 1024**2  # 8 MiB reads when scanning vcf files
+vcf_chunk_size = 10 * 1024**2  # 10 MiB of decompressed vcf split into lines at a time
+download_part_size = 8 * 1024**2  # 8 MiB byte ranges, fetched in parallel
+download_chunk_size = 1024**2  # 1 MiB writes when downloading
 
 
+@functools.lru_cache(maxsize=1)
 def seqrepo_dir():
-    """Return the seqrepo directory."""
+    """Return the seqrepo directory, .env is read once per process."""
     with open(".env") as f:
         for line in f:
             # Ignore comments and empty lines
@@ -42,11 +62,17 @@ def seqrepo_dir():
                     return value + "/latest"
 
 
+@functools.lru_cache(maxsize=32)
 def get_cache_directory(cache_dir: str, cache_name: str) -> str:
     """Return the cache directory."""
     return str(Path(cache_dir) / cache_name)
 
 
+def _cache_key(var: str, fmt: str) -> bytes:
+    """Return the allele translator cache key, bytes keys are stored by diskcache as is rather than pickled."""
+    return var.encode() + b"\x1f" + (fmt or "").encode()
+
+
 class CachingAlleleTranslator(AlleleTranslator):
     """A subclass of AlleleTranslator that uses cache results and adds a method to run in a threaded fashion."""
 
@@ -56,23 +82,36 @@ class CachingAlleleTranslator(AlleleTranslator):
         super().__init__(data_proxy)
         self.normalize = normalize
         self._cache = None
+        self._memory_cache = OrderedDict()
         if manifest and manifest.cache_enabled:
             self._cache = Cache(
                 directory=get_cache_directory(
                     manifest.cache_directory, "allele_translator"
                 ),
                 size_limit=cache_size_limit,
+                sqlite_mmap_size=cache_mmap_size,
             )
         else:
             _logger.info("Cache is not enabled")
+            # chosen once here, so the per variant path never checks for a cache
+            self.translate_from = self._translate_uncached
 
     def translate_from(self, var, fmt=None, **kwargs):
         """Check and update cache"""
 
-        if self._cache is not None:
-            key = f"{var}-{fmt}"
-            if key in self._cache:
-                return self._cache[key]
+        key = _cache_key(var, fmt)
+        allele_id = self._cached(key)
+        if allele_id is not None:
+            return allele_id
+
+        allele_id = self._translate_uncached(var, fmt=fmt, **kwargs)
+        self._cache[key] = allele_id
+        self._remember(key, allele_id)
+
+        return allele_id
+
+    def _translate_uncached(self, var, fmt=None, **kwargs):
+        """Translate without the cache"""
 
         allele = super().translate_from(var, fmt=fmt, **kwargs)
 
@@ -80,11 +119,62 @@ class CachingAlleleTranslator(AlleleTranslator):
             allele, VRS.Allele
         ), f"Allele is not the expected Pydantic Model {type(allele)}: {allele}"
 
-        if self._cache is not None:
-            self._cache[key] = allele.id
-
         return allele.id
 
+    def translate_from_many(
+        self, vars: list[str], fmt=None, return_exceptions: bool = False, **kwargs
+    ) -> list:
+        """Translate a batch of variants, return allele ids in the same order as vars.
+
+        Cache reads and writes are each done in a single transaction.
+        With return_exceptions, a variant that fails has its exception in place of an id.
+        """
+        allele_ids = [None] * len(vars)
+        missing = list(range(len(vars)))
+
+        if self._cache is not None:
+            with self._cache.transact():
+                for i, var in enumerate(vars):
+                    allele_ids[i] = self._cached(_cache_key(var, fmt))
+            missing = [i for i, allele_id in enumerate(allele_ids) if allele_id is None]
+
+        for i in missing:
+            try:
+                allele_ids[i] = self._translate_uncached(vars[i], fmt=fmt, **kwargs)
+            except Exception as exc:
+                if not return_exceptions:
+                    raise
+                allele_ids[i] = exc
+
+        if self._cache is not None and missing:
+            with self._cache.transact():
+                for i in missing:
+                    if isinstance(allele_ids[i], Exception):
+                        continue
+                    key = _cache_key(vars[i], fmt)
+                    self._cache[key] = allele_ids[i]
+                    self._remember(key, allele_ids[i])
+
+        return allele_ids
+
+    def _cached(self, key: bytes) -> Optional[str]:
+        """Return the allele id from the in process LRU or the disk cache, None if not cached."""
+        allele_id = self._memory_cache.get(key)
+        if allele_id is not None:
+            self._memory_cache.move_to_end(key)
+            return allele_id
+        # a single disk lookup, rather than a containment check followed by a read
+        allele_id = self._cache.get(key)
+        if allele_id is not None:
+            self._remember(key, allele_id)
+        return allele_id
+
+    def _remember(self, key: bytes, allele_id: str):
+        """Add to the in process LRU, evicting the least recently used entry when full."""
+        self._memory_cache[key] = allele_id
+        if len(self._memory_cache) > memory_cache_size:
+            self._memory_cache.popitem(last=False)
+
 
 def caching_allele_translator_factory(
     normalize: bool = False, seqrepo_directory: str = None
@@ -102,11 +192,22 @@ def caching_allele_translator_factory(
     return translator
 
 
-def generate_gnomad_ids(vcf_line, compute_for_ref: bool = True) -> list[str]:
+def generate_gnomad_ids(
+    vcf_line,
+    compute_for_ref: bool = True,
+    *,
+    _logged=LOGGED_ALREADY,
+    _log=_logger.error,
+    _is_invalid_alt=INVALID_ALTS.search,
+) -> list[str]:
     """Assuming a standard VCF format with tab-separated fields, generate a gnomAD-like ID from a VCF line.
     see https://github.com/ga4gh/vrs-python/blob/main/src/ga4gh/vrs/extras/vcf_annotation.py#L386-L411
+    The keyword only arguments bind module globals as locals for the per line loop, callers should not pass them.
     """
-    fields = vcf_line.strip().split("\t")
+    if vcf_line.endswith("\n"):
+        vcf_line = vcf_line[:-1]
+    # only the first 5 columns are needed, stop tokenizing before the INFO and sample columns
+    fields = vcf_line.split("\t", 5)
     gnomad_ids = []
     # Extract relevant information (you may need to adjust these indices based on your VCF format)
     chromosome = fields[0]
@@ -120,19 +221,12 @@ def generate_gnomad_ids(vcf_line, compute_for_ref: bool = True) -> list[str]:
     for alt in alternate_allele.split(","):
         alt = alt.strip()
         # TODO - Should we be raising a ValueError hear and let the caller do the logging?
-        # TODO - Should this be a config in the manifest?
-        # ['<INS>', '<DEL>', '<DUP>', '<INV>', '<CNV>', '<DUP:TANDEM>', '<DUP:INT>', '<DUP:EXT>', '*']
-        invalid_alts = ["INS", "DEL", "DUP", "INV", "CNV", "TANDEM", "INT", "EXT", "*"]
-        is_valid = True
-        for invalid_alt in invalid_alts:
-            if invalid_alt in alt:
-                is_valid = False
-                _ = f"Invalid alt found: {alt}"
-                if _ not in LOGGED_ALREADY:
-                    LOGGED_ALREADY.add(_)
-                    _logger.error(_)
-                break
-        if is_valid:
+        if _is_invalid_alt(alt):
+            _ = f"Invalid alt found: {alt}"
+            if _ not in _logged:
+                _logged.add(_)
+                _log(_)
+        else:
             gnomad_ids.append(f"{gnomad_loc}-{reference_allele}-{alt}")
 
     return gnomad_ids
@@ -143,10 +237,9 @@ def params_from_vcf(path, limit=None) -> Generator[dict, None, None]:
     from vrs_anvil.translator import VCFItem
 
     c = 0
-    with open(path, "r") as f:
-        for line in f:
-            if line.startswith("#"):
-                continue
+    with open(path, "r", buffering=vcf_read_buffer_size) as f:
+        # headers only precede the data lines, stop testing for them once past
+        for line in itertools.dropwhile(lambda _: _.startswith("#"), f):
             gnomad_ids = generate_gnomad_ids(line)
             for gnomad_id in gnomad_ids:
                 yield VCFItem(
@@ -162,8 +255,17 @@ def params_from_vcf(path, limit=None) -> Generator[dict, None, None]:
 
 
 def find_items_with_key(dictionary, key_to_find):
-    """Find all items in a dictionary that have a specific key."""
-    result = glom(dictionary, f"**.{key_to_find}")
+    """Find all items in a dictionary that have a specific key, at any depth."""
+    result = []
+    stack = [dictionary]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            if key_to_find in item:
+                result.append(item[key_to_find])
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
     return result
 
 
@@ -173,6 +275,7 @@ class MetaKBProxy(BaseModel):
     metakb_path: Path
     cache_path: Path
     _cache: Optional[Cache] = None
+    _vrs_ids: frozenset[str] = frozenset()
 
     def __init__(self, metakb_path: Path, cache_path: Path, cache: Cache = None):
         super().__init__(metakb_path=metakb_path, cache_path=cache_path, _cache=cache)
@@ -183,13 +286,16 @@ class MetaKBProxy(BaseModel):
             cache = Cache(directory=get_cache_directory(cache_path, "metakb"))
             # cache.stats(enable=True) # drives up disk usage
             if reload_cache:
-                for _ in metakb_ids(metakb_path):
-                    cache.set(_, True)
+                with cache.transact():
+                    for _ in metakb_ids(metakb_path):
+                        cache.set(_, True)
         self._cache = cache
+        # the cache is a set of a few thousand ids, hold them in memory so lookups avoid sqlite
+        self._vrs_ids = frozenset(cache)
 
     def get(self, vrs_id: str) -> bool:
-        """Get the vrs_id from the cache."""
-        return self._cache.get(vrs_id, False)
+        """Is the vrs_id in the metakb."""
+        return vrs_id in self._vrs_ids
 
 
 def metakb_ids(metakb_path) -> Generator[str, None, None]:
@@ -199,30 +305,62 @@ def metakb_ids(metakb_path) -> Generator[str, None, None]:
 
     for file_name in Path(metakb_path).glob("*.json"):
         if file_name.is_file():
-            with open(file_name, "r") as file:
-                data = json.loads(file.read())
-                yield from (
-                    [
-                        _
-                        for _ in find_items_with_key(data, "id")
-                        if _.startswith("ga4gh:VA")
-                    ]
-                )
+            # orjson parses bytes directly, skip the text decode
+            with open(file_name, "rb") as file:
+                data = orjson.loads(file.read())
+            yield from (
+                _ for _ in find_items_with_key(data, "id") if _.startswith("ga4gh:VA")
+            )
 
 
 def _get_metakb_models(metakb_path):
     def _download_s3(url: str, outfile_path: Path) -> None:
-        """Download objects from public s3 bucket
+        """Download objects from public s3 bucket, in parallel byte ranges when the server supports them
 
         :param url: URL for metakb file in s3 bucket
         :param outfile_path: Path where file should be saved
         """
-        with requests.get(url, stream=True) as r:
-            r.raise_for_status()
-            with open(outfile_path, "wb") as h:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        h.write(chunk)
+        # (connect, read) seconds, a stalled range would otherwise hang the executor
+        timeout = (10, 300)
+        head = requests.head(url, timeout=timeout)
+        head.raise_for_status()
+        size = int(head.headers.get("Content-Length", 0))
+
+        if head.headers.get("Accept-Ranges") != "bytes" or size <= download_part_size:
+            with requests.get(url, stream=True, timeout=timeout) as r:
+                r.raise_for_status()
+                with open(outfile_path, "wb") as h:
+                    for chunk in r.iter_content(chunk_size=download_chunk_size):
+                        if chunk:
+                            h.write(chunk)
+            return
+
+        with open(outfile_path, "wb") as h:
+            h.truncate(size)
+
+            def _download_range(start: int) -> None:
+                end = min(start + download_part_size, size) - 1
+                with requests.get(
+                    url,
+                    headers={"Range": f"bytes={start}-{end}"},
+                    stream=True,
+                    timeout=timeout,
+                ) as r:
+                    r.raise_for_status()
+                    # a full 200 body written at this offset would corrupt the archive
+                    if r.status_code != 206:
+                        raise requests.HTTPError(
+                            f"Range request ignored for {url}, status {r.status_code}",
+                            response=r,
+                        )
+                    offset = start
+                    for chunk in r.iter_content(chunk_size=download_chunk_size):
+                        os.pwrite(h.fileno(), chunk, offset)
+                        offset += len(chunk)
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                # consume the results to raise any download errors
+                list(executor.map(_download_range, range(0, size, download_part_size)))
 
     Path(metakb_path).mkdir(exist_ok=True)
 
@@ -244,6 +382,24 @@ def _get_metakb_models(metakb_path):
         os.remove(zip_path)
 
 
+_MANIFEST_DIRECTORIES = [
+    "seqrepo_directory",
+    "metakb_directory",
+    "work_directory",
+    "cache_directory",
+    "state_directory",
+]
+
+_validated_paths: dict[tuple, dict[str, str]] = {}
+"""Manifest directories already checked by this process, keyed by working directory and the raw values"""
+
+
+@functools.lru_cache(maxsize=None)
+def _directory_path(directory: str) -> Path:
+    """Return the Path for a manifest directory, parsed once per process."""
+    return Path(directory)
+
+
 class Manifest(BaseModel):
     """
     A class to represent the manifest file.
@@ -256,6 +412,9 @@ class Manifest(BaseModel):
     num_threads: int = 2
     """Number of threads to use for processing, defaults to 2"""
 
+    use_processes: Optional[bool] = False
+    """Translate with a pool of num_threads processes instead of threads"""
+
     # TODO: not implemented
     annotate_vcfs: bool = False
     """Should we create new VCFs with annotations. FOR FUTURE USE"""
@@ -293,26 +452,55 @@ class Manifest(BaseModel):
 
     disable_progress_bars: Optional[bool] = False
 
+    metrics_format: Literal["yaml", "json"] = "yaml"
+    """Format of the metrics file, json is much faster to write for large runs"""
+
     @model_validator(mode="after")
     def check_paths(self) -> "Manifest":
-        """Post init method to set the cache directory."""
-        self.seqrepo_directory = str(Path(self.seqrepo_directory).expanduser())
-        self.work_directory = str(Path(self.work_directory).expanduser())
-        self.cache_directory = str(Path(self.cache_directory).expanduser())
-        self.state_directory = str(Path(self.state_directory).expanduser())
-        self.metakb_directory = str(Path(self.metakb_directory).expanduser())
-
-        for _ in ["seqrepo_directory", "metakb_directory"]:
-            if not Path(getattr(self, _)).exists():
-                raise ValueError(f"{_} does not exist")
-
-        for _ in ["work_directory", "cache_directory", "state_directory"]:
-            if not Path(getattr(self, _)).exists():
-                Path(getattr(self, _)).mkdir(parents=True, exist_ok=True)
-                _logger.debug(f"Created directory {getattr(self, _)}")
+        """Post init method to expand the directories, check they exist and create the working ones.
+        The seqrepo and metakb directories are only checked once per process for a given set of directories.
+        """
+        raw_paths = (os.getcwd(),) + tuple(
+            getattr(self, _) for _ in _MANIFEST_DIRECTORIES
+        )
+        expanded_paths = _validated_paths.get(raw_paths)
+
+        if expanded_paths is None:
+            expanded_paths = {}
+            for _ in ["seqrepo_directory", "metakb_directory"]:
+                path = Path(getattr(self, _)).expanduser()
+                if not path.exists():
+                    raise ValueError(f"{_} does not exist")
+                expanded_paths[_] = str(path)
+
+            for _ in ["work_directory", "cache_directory", "state_directory"]:
+                path = Path(getattr(self, _)).expanduser()
+                if not path.exists():
+                    path.mkdir(parents=True, exist_ok=True)
+                    _logger.debug("Created directory %s", path)
+                expanded_paths[_] = str(path)
+
+            _validated_paths[raw_paths] = expanded_paths
+        else:
+            # the working directories may have been removed since they were checked
+            for _ in ["work_directory", "cache_directory", "state_directory"]:
+                Path(expanded_paths[_]).mkdir(parents=True, exist_ok=True)
+
+        for _, path in expanded_paths.items():
+            setattr(self, _, path)
 
         return self
 
+    @property
+    def state_path(self) -> Path:
+        """The state_directory as a Path"""
+        return _directory_path(self.state_directory)
+
+    @property
+    def work_path(self) -> Path:
+        """The work_directory as a Path"""
+        return _directory_path(self.work_directory)
+
 
 def query_metakb(vrs_id, log=False):
     """Query metakb using vrs id"""
@@ -322,7 +510,7 @@ def query_metakb(vrs_id, log=False):
         print(f"API error: {response.text} ({response.status_code})")
         return
 
-    response_json = response.json()
+    response_json = orjson.loads(response.content)
 
     if not response_json["warnings"]:
         return response_json
@@ -353,4 +541,10 @@ def get_process_info(pid):
 def save_manifest(manifest: Manifest, manifest_path: str):
     """pass in a Manifest and yaml path"""
     with open(manifest_path, "w") as stream:
-        yaml.dump(manifest.model_dump(), stream)
+        yaml.dump(
+            manifest.model_dump(),
+            stream,
+            Dumper=YamlDumper,
+            sort_keys=False,
+            default_flow_style=False,
+        )
@@ -1,17 +1,19 @@
 import gzip
+import itertools
 import logging
+import os
 import pathlib
 import time
-from collections import defaultdict
 from datetime import datetime
 from typing import Generator
 
+import orjson
 import yaml
 from ga4gh.vrs import models as VRS
 from tqdm import tqdm
 
 import vrs_anvil
-from vrs_anvil import Manifest, generate_gnomad_ids
+from vrs_anvil import Manifest, YamlDumper, generate_gnomad_ids
 from vrs_anvil.collector import collect_manifest_urls
 from vrs_anvil.translator import Translator, VCFItem
 
@@ -24,8 +26,9 @@ TOTAL = "total"
 STATUS = "status"
 SUCCESSES = "successes"
 ERROR = "error"
+ERRORS = "errors"
 METAKB_HITS = "metakb_hits"
-MATCHES = "matches"
+MATCHES_FILE = "matches_file"
 START_TIME = "start_time"
 END_TIME = "end_time"
 ELAPSED_TIME = "elapsed_time"
@@ -34,12 +37,19 @@ VRS_OBJECT = "vrs_object"
 TIMESTAMP = "timestamp_str"
 
 
-def recursive_defaultdict():
-    """Implicitly create an entry if a key is read that doesn’t yet exist, any level deep"""
-    return defaultdict(recursive_defaultdict)
+metrics = {}
+"""Metrics for the run, keyed by file path and TOTAL."""
 
 
-metrics = recursive_defaultdict()
+def _new_file_metrics() -> dict:
+    """Return the metrics for a file before any of it has been read."""
+    return {
+        STATUS: "started",
+        START_TIME: time.time(),
+        SUCCESSES: 0,
+        METAKB_HITS: 0,
+        ERRORS: {},
+    }
 
 
 def _work_file_generator(manifest: Manifest) -> Generator[pathlib.Path, None, None]:
@@ -50,35 +60,47 @@ def _work_file_generator(manifest: Manifest) -> Generator[pathlib.Path, None, No
         yield work_file
 
 
+def _iter_lines_chunked(f, chunk_size: int = None) -> Generator[bytes, None, None]:
+    """Yield the lines of a binary file without their newline, reading chunk_size bytes at a time."""
+    chunk_size = chunk_size or vrs_anvil.vcf_chunk_size
+    leftover = b""
+    while chunk := f.read(chunk_size):
+        lines = (leftover + chunk).split(b"\n")
+        leftover = lines.pop()
+        yield from lines
+    if leftover:
+        yield leftover
+
+
 def _vcf_item_generator(manifest: Manifest) -> Generator[tuple, None, None]:
     """Return a VCFItem for each line in the vcf."""
     total_lines = 0
     for work_file in tqdm(
         _work_file_generator(manifest),
         total=len(manifest.vcf_files),
+        mininterval=1.0,
         disable=manifest.disable_progress_bars,
     ):
         line_number = 0
-        if "gz" in str(work_file):
-            f = gzip.open(work_file, "rt")
+        # read bytes, header lines are skipped without being decoded
+        if work_file.suffix in (".gz", ".bgz"):
+            f = gzip.open(work_file, "rb")
         else:
-            f = open(work_file, "r")
+            f = open(work_file, "rb", buffering=vrs_anvil.vcf_read_buffer_size)
         with f:
-            key = str(work_file)
-            metrics[key][STATUS] = "started"
-            metrics[key][START_TIME] = time.time()
-            metrics[key][SUCCESSES] = 0
-            metrics[key][METAKB_HITS] = 0
-
-            for line in f:
-                if line.startswith("#"):
-                    continue
-
+            file_metrics = metrics[str(work_file)] = _new_file_metrics()
+            # elapsed times come from the monotonic clock, immune to wall clock adjustments
+            started_ns = time.monotonic_ns()
+
+            # headers only precede the data lines, stop testing for them once past
+            for line in itertools.dropwhile(
+                lambda _: _.startswith(b"#"), _iter_lines_chunked(f)
+            ):
                 line_number += 1
                 total_lines += 1
 
                 for gnomad_id in generate_gnomad_ids(
-                    line, compute_for_ref=manifest.compute_for_ref
+                    line.decode(), compute_for_ref=manifest.compute_for_ref
                 ):
                     yield VCFItem(
                         fmt="gnomad",
@@ -88,16 +110,14 @@ def _vcf_item_generator(manifest: Manifest) -> Generator[tuple, None, None]:
                     )  # {"fmt": "gnomad", "var": gnomad_id}, work_file, line_number
 
                 if manifest.limit and line_number > manifest.limit:
-                    _logger.info(f"Limit of {manifest.limit} reached, stopping")
+                    _logger.info("Limit of %s reached, stopping", manifest.limit)
                     break
 
-            _logger.info(f"Setting metrics for {work_file}")
-            metrics[key][STATUS] = "finished"
-            metrics[key][END_TIME] = time.time()
-            metrics[key][LINE_COUNT] = line_number
-            metrics[key][ELAPSED_TIME] = (
-                metrics[key][END_TIME] - metrics[key][START_TIME]
-            )
+            _logger.info("Setting metrics for %s", work_file)
+            file_metrics[STATUS] = "finished"
+            file_metrics[END_TIME] = time.time()
+            file_metrics[LINE_COUNT] = line_number
+            file_metrics[ELAPSED_TIME] = (time.monotonic_ns() - started_ns) / 1e9
 
     _logger.info(
         f"_vcf_generator: Finished processing all files in the manifest {total_lines} lines processed."
@@ -106,12 +126,16 @@ def _vcf_item_generator(manifest: Manifest) -> Generator[tuple, None, None]:
 
 def _vrs_generator(manifest: Manifest) -> Generator[dict, None, None]:
     """Return a generator for the VRS ids."""
-    tlr = Translator(normalize=manifest.normalize)
+    tlr = Translator(normalize=manifest.normalize, use_processes=manifest.use_processes)
     c = 0
     for result in tlr.translate_from(
         generator=tqdm(
             _vcf_item_generator(manifest),
             total=manifest.estimated_vcf_lines,
+            # redraw at most once a second and check the clock every 10k items, not every item
+            mininterval=1.0,
+            miniters=10_000,
+            smoothing=0,
             disable=manifest.disable_progress_bars,
         ),
         num_threads=manifest.num_threads,
@@ -142,70 +166,88 @@ def annotate_all(
     )
     _logger.info("annotate_all: completed metakb init.")
 
-    metrics[TOTAL][START_TIME] = time.time()
-    total_errors = 0
-    for result in _vrs_generator(manifest):
-        assert result is not None, "result is None"
-        assert isinstance(result, VCFItem), "result is not a VCFItem"
-
-        file_path = str(result.file_name)
-
-        if ERROR in result:
-            errors = metrics[file_path][ERROR]
-            if result[ERROR] not in errors:
-                errors[result[ERROR]] = 0
-            errors[result[ERROR]] += 1
-            total_errors += 1
-            if total_errors > max_errors:
-                break
-        else:
-            allele_id = result.result
-
-            metrics[file_path][SUCCESSES] += 1
-
-            # check metaKB cache, TODO - it would be nice if we had the metakb.study.id and added that to result_dict
-            if metakb_proxy.get(allele_id):
-                _logger.info(f"VRS id {allele_id} found in metakb. {result}")
+    # Append timestamp or suffix to filename
+    if not timestamp_str:
+        timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
+    state_directory = manifest.state_path
 
-                # add vrs_id, allele_dict, actual evidence to this object as well (#3)
-                metrics[file_path][MATCHES][allele_id] = {
-                    "fmt": result.fmt,
-                    "var": result.var,
-                }
+    # matches are streamed to disk as they are found, only counters are kept in memory
+    matches_file = state_directory / f"matches_{timestamp_str}.jsonl"
 
-                metrics[file_path][METAKB_HITS] += 1
+    metrics[TOTAL] = {START_TIME: time.time(), MATCHES_FILE: str(matches_file)}
+    started_ns = time.monotonic_ns()
+    total_errors = 0
+    file_name = file_path = file_metrics = None
+    with open(matches_file, "wb", buffering=1024**2) as matches_stream:
+        for result in _vrs_generator(manifest):
+            assert result is not None, "result is None"
+            assert isinstance(result, VCFItem), "result is not a VCFItem"
+
+            # results arrive grouped by file, only look the file up when it changes
+            # registered by _vcf_item_generator before the file's first item
+            if result.file_name is not file_name:
+                file_name = result.file_name
+                file_path = str(file_name)
+                file_metrics = metrics[file_path]
+
+            error = result.error
+            if error is not None:
+                errors = file_metrics[ERRORS]
+                errors[error] = errors.get(error, 0) + 1
+                total_errors += 1
+                if total_errors > max_errors:
+                    break
+            else:
+                allele_id = result.result
+
+                file_metrics[SUCCESSES] += 1
+
+                # check metaKB cache, TODO - it would be nice if we had the metakb.study.id and added that to result_dict
+                if metakb_proxy.get(allele_id):
+                    _logger.info("VRS id %s found in metakb. %s", allele_id, result)
+
+                    # add vrs_id, allele_dict, actual evidence to this object as well (#3)
+                    matches_stream.write(
+                        orjson.dumps(
+                            {
+                                "file_name": file_path,
+                                "line_number": result.line_number,
+                                "allele_id": allele_id,
+                                "fmt": result.fmt,
+                                "var": result.var,
+                            }
+                        )
+                        + b"\n"
+                    )
+
+                    file_metrics[METAKB_HITS] += 1
 
     _logger.info("annotate_all: Finished processing results.")
 
     metrics[TOTAL][TIMESTAMP] = timestamp_str
     metrics[TOTAL][END_TIME] = time.time()
-    metrics[TOTAL][ELAPSED_TIME] = metrics[TOTAL][END_TIME] - metrics[TOTAL][START_TIME]
-    metrics[TOTAL][SUCCESSES] = sum(
-        [metrics[key].get(SUCCESSES, 0) for key in metrics.keys() if key != TOTAL]
-    )
-    metrics[TOTAL]["errors"] = sum(
-        [sum(metrics[key]["errors"].values()) for key in metrics.keys() if key != TOTAL]
-    )
+    metrics[TOTAL][ELAPSED_TIME] = (time.monotonic_ns() - started_ns) / 1e9
+    all_file_metrics = [v for k, v in metrics.items() if k != TOTAL]
+    metrics[TOTAL][SUCCESSES] = sum(_[SUCCESSES] for _ in all_file_metrics)
+    metrics[TOTAL][ERRORS] = sum(sum(_[ERRORS].values()) for _ in all_file_metrics)
 
     _logger.info("annotate_all: Finished calculating metrics.")
 
-    # Append timestamp or suffix to filename
-    if not timestamp_str:
-        timestamp_str = datetime.now().strftime("%Y%m%d_%H%M%S")
     metrics_file = (
-        pathlib.Path(manifest.state_directory) / f"metrics_{timestamp_str}.yaml"
+        state_directory / f"metrics_{timestamp_str}.{manifest.metrics_format}"
     )
-    with open(metrics_file, "w") as f:
-        # clean up the recursive dict into a plain old dict so that it serialized to yaml neatly
-        for k, v in metrics.items():
-            metrics[k] = dict(v)
-            if k != TOTAL:
-                if "errors" in metrics[k]:
-                    metrics[k]["errors"] = dict(metrics[k]["errors"])
-                if MATCHES in metrics[k]:
-                    metrics[k][MATCHES] = dict(metrics[k][MATCHES])
-
-        yaml.dump(dict(metrics), f)
+    if manifest.metrics_format == "json":
+        content = orjson.dumps(metrics, option=orjson.OPT_INDENT_2)
+    else:
+        content = yaml.dump(metrics, Dumper=YamlDumper).encode()
+
+    # written aside and renamed, a crash never leaves a partial metrics file, hidden so ps does not list it
+    tmp_file = metrics_file.with_name(f".{metrics_file.name}.tmp")
+    with open(tmp_file, "wb") as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, metrics_file)
 
     _logger.info("annotate_all: Finished writing metrics.")
 
@@ -1,18 +1,29 @@
 import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from typing import Any, NamedTuple, Optional
 
 import click
+import orjson
 import yaml
 import logging
 
 from vrs_anvil import (
     Manifest,
+    YamlLoader,
     run_command_in_background,
     get_process_info,
     save_manifest,
 )
 from vrs_anvil.annotator import annotate_all
-from logging.handlers import RotatingFileHandler
+from logging.handlers import (
+    MemoryHandler,
+    QueueHandler,
+    QueueListener,
+    RotatingFileHandler,
+)
 import pathlib
 
 # Set up logging
@@ -21,6 +32,86 @@ log_format = "%(asctime)s %(threadName)s %(name)s [%(levelname)s] %(message)s"
 _logger = logging.getLogger("vrs_anvil.cli")
 
 
+class TimedMemoryHandler(MemoryHandler):
+    """A MemoryHandler that also flushes when a record arrives flush_interval seconds after the last flush,
+    a process that stops logging is flushed by FlushingQueueListener."""
+
+    def __init__(self, capacity, flush_interval: float = 1.0, **kwargs):
+        super().__init__(capacity, **kwargs)
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+
+    def shouldFlush(self, record):
+        return (
+            super().shouldFlush(record)
+            or time.monotonic() - self._last_flush >= self.flush_interval
+        )
+
+    def flush(self):
+        super().flush()
+        self._last_flush = time.monotonic()
+
+
+class FlushingQueueListener(QueueListener):
+    """A QueueListener that flushes its handlers whenever the queue has been empty for flush_interval seconds,
+    so records buffered by a TimedMemoryHandler are written even when no further records arrive.
+    """
+
+    def __init__(self, queue, *handlers, flush_interval: float = 1.0, **kwargs):
+        super().__init__(queue, *handlers, **kwargs)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        if not block:
+            return super().dequeue(block)
+        while True:
+            try:
+                return self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.flush()
+
+
+class ProcessSample(NamedTuple):
+    """The status and resource usage of a scattered process, as shown by ps."""
+
+    status: str
+    cpu_percent: Any = "NA"
+    io_counters: Any = "NA"
+    memory_info: Any = "NA"
+
+
+def _sample_process(process_info) -> Optional[ProcessSample]:
+    """Read a process from /proc, None if it is not running or has finished."""
+    if not process_info:
+        return None
+    try:
+        status = process_info.status()
+    except Exception as exc:
+        _logger.info("could not get status pid: %s error:%s", process_info.pid, exc)
+        return None
+    if status != "running":
+        return ProcessSample(status)
+
+    io_counters = "NA"
+    memory_info = "NA"
+    cpu_percent = "NA"
+    try:
+        if hasattr(process_info, "io_counters"):
+            io_counters = process_info.io_counters()
+        if hasattr(process_info, "memory_info"):
+            memory_info = process_info.memory_info()
+        if hasattr(process_info, "cpu_percent"):
+            cpu_percent = process_info.cpu_percent(interval=None)
+    except Exception as exc:
+        _logger.info(
+            "could not get io_counters/memory_info pid: %s error:%s",
+            process_info.pid,
+            exc,
+        )
+    return ProcessSample(status, cpu_percent, io_counters, memory_info)
+
+
 @click.group(invoke_without_command=True)
 @click.version_option(package_name="vrs_anvil_toolkit")
 @click.option(
@@ -49,45 +140,68 @@ def cli(ctx, verbose: bool, manifest: str, max_errors: int, suffix: str):
 
     try:
         with open(manifest, "r") as stream:
-            manifest = Manifest.model_validate(yaml.safe_load(stream))
+            manifest = Manifest.model_validate(yaml.load(stream, Loader=YamlLoader))
 
-            # only create a persistent log for annotate subcommand
-            if ctx.invoked_subcommand == "annotate":
+        # only create a persistent log for annotate subcommand
+        if ctx.invoked_subcommand == "annotate":
 
-                # Create a rotating file handler with a max size of 10MB and keep 3 backup files
-                log_path = (
-                    pathlib.Path(manifest.state_directory)
-                    / f"vrs_anvil_{timestamp_str}.log"
-                )
-                file_handler = RotatingFileHandler(
-                    log_path, maxBytes=10 * 1024 * 1024, backupCount=3
-                )
-                file_handler.setLevel(_log_level)
-                file_handler.setFormatter(logging.Formatter(log_format))
-
-                # Add the file handler to the logger
-                # logger.addHandler(file_handler)
-                # basicConfig call removed, which prevents the default configuration that logs to the console.
-                logging.basicConfig(
-                    level=_log_level, format=log_format, handlers=[file_handler]
-                )
+            # Create a rotating file handler with a max size of 10MB and keep 3 backup files
+            log_path = manifest.state_path / f"vrs_anvil_{timestamp_str}.log"
+            file_handler = RotatingFileHandler(
+                log_path, maxBytes=10 * 1024 * 1024, backupCount=3
+            )
+            file_handler.setLevel(_log_level)
+            file_handler.setFormatter(logging.Formatter(log_format))
 
-                click.secho(
-                    f"🪵  Logging to {log_path}, level {logging.getLevelName(_log_level)}",
-                    fg="yellow",
-                )
+            # writes are batched, up to 512 records or a second, errors are written straight away,
+            # the listener flushes the batch when the process goes quiet
+            memory_handler = TimedMemoryHandler(
+                512, flushLevel=logging.ERROR, target=file_handler
+            )
+            memory_handler.setLevel(_log_level)
+
+            # records are queued by the logging thread and written to the file by a listener thread
+            log_queue = queue.SimpleQueue()
+            queue_handler = QueueHandler(log_queue)
+            # the listener's file handler applies log_format, the queued record only carries the message
+            queue_handler.setFormatter(logging.Formatter("%(message)s"))
+            listener = FlushingQueueListener(
+                log_queue, memory_handler, respect_handler_level=True
+            )
+            listener.start()
 
-            else:
-                logging.basicConfig(level=_log_level, format=log_format)
+            # added directly rather than with basicConfig, which does nothing if the root logger has handlers
+            root_logger = logging.getLogger()
+            root_level = root_logger.level
+            root_logger.setLevel(_log_level)
+            root_logger.addHandler(queue_handler)
+
+            def _close_log():
+                """Undo the logging set up for this invocation, the queue is drained and the buffer written first."""
+                root_logger.removeHandler(queue_handler)
+                root_logger.setLevel(root_level)
+                listener.stop()
+                memory_handler.close()
+                file_handler.close()
 
-            ctx.ensure_object(dict)
-            ctx.obj["manifest"] = manifest
-            ctx.obj["verbose"] = verbose
-            ctx.obj["max_errors"] = max_errors
-            ctx.obj["timestamp_str"] = timestamp_str
+            ctx.call_on_close(_close_log)
+
+            click.secho(
+                f"🪵  Logging to {log_path}, level {logging.getLevelName(_log_level)}",
+                fg="yellow",
+            )
+
+        else:
+            logging.basicConfig(level=_log_level, format=log_format)
+
+        ctx.ensure_object(dict)
+        ctx.obj["manifest"] = manifest
+        ctx.obj["verbose"] = verbose
+        ctx.obj["max_errors"] = max_errors
+        ctx.obj["timestamp_str"] = timestamp_str
 
-            if verbose:
-                click.secho(f"📢  {manifest}", fg="green")
+        if verbose:
+            click.secho(f"📢  {manifest}", fg="green")
     except Exception as exc:
         click.secho(f"{exc}", fg="yellow")
         ctx.ensure_object(dict)
@@ -116,7 +230,7 @@ def annotate_cli(ctx, scatter: bool):
             manifest_path = f"{manifest.work_directory}/manifest_{timestamp_str}.yaml"
             save_manifest(manifest, manifest_path)
             click.secho(f"🔑 Manifest saved at {manifest_path}", fg="yellow")
-            _logger.debug(f"Manifest: {ctx.obj['manifest']}")
+            _logger.debug("Manifest: %s", ctx.obj["manifest"])
 
             click.secho("🚧  annotating variants", fg="yellow")
             metrics_file = annotate_all(
@@ -134,19 +248,22 @@ def annotate_cli(ctx, scatter: bool):
 
             for i, vcf_file in enumerate(parent_manifest.vcf_files):
                 # create a new manifest for each VCF file based on the parent manifest
-                child_manifest = parent_manifest.copy(deep=True)
-                child_manifest.vcf_files = [vcf_file]
-                child_manifest.num_threads = 1
-                child_manifest.disable_progress_bars = True
+                # copied without revalidating, the parent manifest was validated on load
+                child_manifest = parent_manifest.model_copy(
+                    update={
+                        "vcf_files": [vcf_file],
+                        "num_threads": 1,
+                        "disable_progress_bars": True,
+                    }
+                )
 
                 suffix_str = f"scattered_{timestamp_str}_{i}"
                 child_manifest_path = (
-                    pathlib.Path(child_manifest.work_directory)
-                    / f"manifest_{suffix_str}.yaml"
+                    child_manifest.work_path / f"manifest_{suffix_str}.yaml"
                 )
                 save_manifest(child_manifest, child_manifest_path)
                 click.secho(f"🔑 Manifest saved at {child_manifest_path}", fg="yellow")
-                _logger.debug(f"Manifest: {ctx.obj['manifest']}")
+                _logger.debug("Manifest: %s", ctx.obj["manifest"])
 
                 # run process to annotate each manifest
                 process = run_command_in_background(
@@ -164,17 +281,16 @@ def annotate_cli(ctx, scatter: bool):
                 )
                 child_processes.append(process)
 
-            # associate scattered processes to process id in yaml
+            # associate scattered processes to process id, only ps reads this file
             scattered_processes_path = (
-                pathlib.Path(parent_manifest.work_directory)
-                / f"scattered_processes_{timestamp_str}.yaml"
+                parent_manifest.work_path / f"scattered_processes_{timestamp_str}.json"
             )
             scattered_processes = {
                 "parent_pid": os.getpid(),
                 "processes": scattered_processes,
             }
-            with open(scattered_processes_path, "w") as stream:
-                yaml.dump(scattered_processes, stream)
+            with open(scattered_processes_path, "wb") as stream:
+                stream.write(orjson.dumps(scattered_processes))
             click.secho(
                 f"📊 scattered processes available in {scattered_processes_path}",
                 fg="green",
@@ -213,11 +329,16 @@ def ps_cli(ctx):
 
         # get most recent set of scattered manifests
         file_prefix = "scattered_processes_"
-        filename_match = f"{file_prefix}*.yaml"
+        filename_match = f"{file_prefix}*.json"
 
-        scattered_processes_path = pathlib.Path(parent_manifest.work_directory)
+        # yaml files were written by earlier releases, json is preferred for the same timestamp
         scattered_processes_paths = sorted(
-            x for x in scattered_processes_path.glob(filename_match)
+            (
+                x
+                for x in parent_manifest.work_path.glob(f"{file_prefix}*")
+                if x.suffix in (".json", ".yaml")
+            ),
+            key=lambda x: (x.stem, x.suffix == ".json"),
         )
         if not scattered_processes_paths:
             click.secho(
@@ -227,59 +348,81 @@ def ps_cli(ctx):
             return
         scattered_processes_path = scattered_processes_paths[-1]
 
+        # list the state directory once, logs and metrics are keyed by their scatter suffix
+        state_dir = parent_manifest.state_path
+        log_files = {}
+        metrics_files = {}
+        try:
+            with os.scandir(state_dir) as entries:
+                for entry in entries:
+                    stem, _, extension = entry.name.partition(".")
+                    if stem.startswith("vrs_anvil_") and extension == "log":
+                        log_files[stem.removeprefix("vrs_anvil_")] = (
+                            state_dir / entry.name
+                        )
+                    elif stem.startswith("metrics_"):
+                        metrics_files[stem.removeprefix("metrics_")] = (
+                            state_dir / entry.name
+                        )
+        except FileNotFoundError:
+            pass
+
         # list associated info for each process
-        state_dir = pathlib.Path(parent_manifest.state_directory)
-        with open(scattered_processes_path, "r") as stream:
-            scattered_processes = yaml.safe_load(stream)
+        with open(scattered_processes_path, "rb") as stream:
+            if scattered_processes_path.suffix == ".json":
+                scattered_processes = orjson.loads(stream.read())
+            else:
+                scattered_processes = yaml.load(stream, Loader=YamlLoader)
+
+            # cpu_percent measures since the previous call, so unfinished processes are
+            # primed together and sampled after a single wait rather than blocking on each
+            process_infos = []
             for process in scattered_processes["processes"]:
-                manifest_path = process["manifest"]
-                timestamp_str = (
-                    str(manifest_path).split("manifest_scattered_")[1].split(".")[0]
+                suffix_str = pathlib.Path(process["manifest"]).stem.removeprefix(
+                    "manifest_"
                 )
-
-                log_file = "NA"
-                metrics_file = "NA"
-
+                process_info = None
+                if suffix_str not in metrics_files:
+                    process_info = get_process_info(process["pid"])
                 try:
-                    log_file = list(state_dir.glob(f"vrs_anvil_*{timestamp_str}.log"))[
-                        -1
-                    ]
-                    metrics_file = list(
-                        state_dir.glob(f"metrics_*{timestamp_str}.yaml")
-                    )[-1]
-                except Exception:
-                    pass
+                    if process_info:
+                        process_info.cpu_percent(interval=None)
+                except Exception as exc:
+                    _logger.info(
+                        "could not get cpu_percent pid: %s error:%s",
+                        process["pid"],
+                        exc,
+                    )
+                process_infos.append((process, suffix_str, process_info))
+            if any(process_info for _, _, process_info in process_infos):
+                time.sleep(0.1)
+
+            # the /proc reads are independent, processes are sampled concurrently then printed in order
+            with ThreadPoolExecutor(
+                max_workers=min(32, len(process_infos)) or 1
+            ) as executor:
+                samples = list(
+                    executor.map(
+                        _sample_process,
+                        [process_info for _, _, process_info in process_infos],
+                    )
+                )
+
+            for (process, suffix_str, _), sample in zip(process_infos, samples):
+                log_file = log_files.get(suffix_str, "NA")
+                metrics_file = metrics_files.get(suffix_str, "NA")
 
                 click.secho(
                     f"🚧  pid: {str(process['pid'])}, manifest: {str(process['manifest'])}, vcf: {str(process['vcf'])}, metrics_file: {metrics_file}, log_file: {log_file}",
                     fg="yellow",
                 )
-                process_info = get_process_info(process["pid"])
-                if not process_info or metrics_file != "NA":
+                if not sample:
                     click.secho("  ✅  completed", fg="green")
-                else:
-                    io_counters = "NA"
-                    memory_info = "NA"
-                    cpu_percent = "NA"
-
-                    status = process_info.status()
-                    if status == "running":
-                        try:
-                            if hasattr(process_info, "io_counters"):
-                                io_counters = process_info.io_counters()
-                            if hasattr(process_info, "memory_info"):
-                                memory_info = process_info.memory_info()
-                            if hasattr(process_info, "cpu_percent"):
-                                cpu_percent = process_info.cpu_percent(interval=0.1)
-                        except Exception as exc:
-                            _logger.info(
-                                f"could not get io_counters/memory_info pid: {process['pid']} error:{exc}"
-                            )
-
-                        click.secho(
-                            f"  📊 {status.capitalize()}: cpu_percent: {cpu_percent}%, io_counters: {io_counters}, memory_info: {memory_info}",
-                            fg="yellow",
-                        )
+                elif sample.status == "running":
+                    click.secho(
+                        f"  📊 {sample.status.capitalize()}: cpu_percent: {sample.cpu_percent}%, io_counters: {sample.io_counters}, memory_info: {sample.memory_info}",
+                        fg="yellow",
+                    )
     except Exception as exc:
         click.secho(f"{exc}", fg="red")
         _logger.exception(exc)
@@ -1,29 +1,44 @@
+import errno
+import functools
+import logging
 import os
 import pathlib
+import shutil
 from typing import Generator
 import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from vrs_anvil import Manifest
-from google.cloud import storage
-import boto3
+from vrs_anvil import Manifest, download_chunk_size
+
+_logger = logging.getLogger("vrs_anvil.collector")
+
+
+@functools.lru_cache(maxsize=1)
+def _s3_client():
+    """Return the S3 client shared by downloads, credentials are discovered once per process."""
+    # imported on first use, local manifests and commands like ps never pay for the cloud SDKs
+    import boto3
+
+    return boto3.client("s3")
+
+
+@functools.lru_cache(maxsize=1)
+def _storage_client():
+    """Return the Google Cloud Storage client shared by downloads."""
+    from google.cloud import storage
+
+    return storage.Client()
 
 
 # TODO - not tested
 def download_s3_object(bucket_name, object_name, destination_file_name) -> str:
     """Download an object from an S3 bucket and save it to a file."""
-    if os.path.exists(destination_file_name):
-        return destination_file_name
-    s3 = boto3.client("s3")
-    s3.download_http_file(bucket_name, object_name, destination_file_name)
+    _s3_client().download_file(bucket_name, object_name, destination_file_name)
     return destination_file_name
 
 
 def download_google_blob(bucket_name, source_blob_name, destination_file_name) -> str:
     """Downloads a blob from the bucket."""
-    if os.path.exists(destination_file_name):
-        return destination_file_name
-
-    storage_client = storage.Client()
+    storage_client = _storage_client()
     assert "GOOGLE_PROJECT" in os.environ, "GOOGLE_PROJECT environment variable not set"
     bucket = storage_client.bucket(
         bucket_name, user_project=os.getenv("GOOGLE_PROJECT")
@@ -34,21 +49,33 @@ def download_google_blob(bucket_name, source_blob_name, destination_file_name) -
     return destination_file_name
 
 
+@functools.lru_cache(maxsize=1)
+def _http_session() -> requests.Session:
+    """Return the session shared by http downloads, connections and TLS sessions are pooled across files."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 # TODO - not tested
 def download_http_file(url, destination_dir) -> str:
     """Download a file from a URL and save it to a directory."""
     filename = os.path.join(destination_dir, url.split("/")[-1])
-    # check if file already exists
-    if os.path.exists(filename):
-        return filename
-    response = requests.get(url)
-    with open(filename, "wb") as f:
-        f.write(response.content)
+    # streamed to disk rather than held in memory, and renamed once complete so a partial file is never reused
+    partial_filename = f"{filename}.part"
+    with _http_session().get(url, stream=True, timeout=(10, 300)) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        with open(partial_filename, "wb") as f:
+            shutil.copyfileobj(response.raw, f, length=download_chunk_size)
+    os.replace(partial_filename, filename)
     return filename
 
 
 def create_symlink_to_work_directory(work_directory: str, vcf_file: str) -> str:
-    """Create a link to the work directory for vcf file."""
+    """Create a link to the work directory for vcf file, or a copy if it can not be linked."""
     # Extract the filename from the vcf_file path
 
     vcf_filename = os.path.basename(vcf_file)
@@ -60,65 +87,94 @@ def create_symlink_to_work_directory(work_directory: str, vcf_file: str) -> str:
     if os.path.islink(symlink_path):
         os.unlink(symlink_path)
 
-    # Create the symlink
+    # Create the symlink, or copy where links are not possible, copyfile copies in the kernel (sendfile) on linux
     vcf_file = os.path.abspath(vcf_file)
-    os.symlink(vcf_file, symlink_path)
+    try:
+        os.symlink(vcf_file, symlink_path)
+    except OSError as exc:
+        # only where symlinks are not supported, other errors are raised rather than hidden by copying a large vcf
+        if exc.errno not in (errno.EPERM, errno.ENOTSUP, errno.EXDEV):
+            raise
+        _logger.warning(
+            "Could not link %s (%s), copying it to %s", vcf_file, exc, symlink_path
+        )
+        shutil.copyfile(vcf_file, symlink_path)
 
     return symlink_path
 
 
+def _already_downloaded(file_name: str) -> bool:
+    """True if a previous run downloaded the file, an empty file is treated as an interrupted download."""
+    try:
+        return os.stat(file_name).st_size > 0
+    except FileNotFoundError:
+        return False
+
+
+def _http_task(vcf_file: str, path: str, work_directory: str) -> tuple:
+    """Return the destination and download call for a http(s) url."""
+    destination_file_name = os.path.join(work_directory, vcf_file.split("/")[-1])
+    return destination_file_name, download_http_file, (vcf_file, work_directory)
+
+
+def _gs_task(vcf_file: str, path: str, work_directory: str) -> tuple:
+    """Return the destination and download call for a gs:// url."""
+    bucket_name, blob_name = path.split("/", 1)
+    destination_file_name = os.path.join(work_directory, blob_name)
+    return (
+        destination_file_name,
+        download_google_blob,
+        (bucket_name, blob_name, destination_file_name),
+    )
+
+
+def _s3_task(vcf_file: str, path: str, work_directory: str) -> tuple:
+    """Return the destination and download call for a s3:// url."""
+    bucket_name, object_name = path.split("/", 1)
+    destination_file_name = os.path.join(work_directory, object_name)
+    return (
+        destination_file_name,
+        download_s3_object,
+        (bucket_name, object_name, destination_file_name),
+    )
+
+
+def _local_task(vcf_file: str, path: str, work_directory: str) -> tuple:
+    """Return the link call for a local or file:// path, there is nothing to download."""
+    return None, create_symlink_to_work_directory, (work_directory, path)
+
+
+_scheme_tasks = {
+    "http": _http_task,
+    "https": _http_task,
+    "gs": _gs_task,
+    "s3": _s3_task,
+    "file": _local_task,
+}
+"""Task builders keyed by url scheme, anything else is a local path."""
+
+
 def collect_manifest_urls(manifest: Manifest) -> Generator[str, None, None]:
-    """Collect the URLs from the manifest and download them."""
+    """Collect the URLs from the manifest and download them, files downloaded by a previous run are reused."""
     # TODO - is this really too many threads? each download is IO bound
     with ThreadPoolExecutor(max_workers=max(len(manifest.vcf_files), 8)) as executor:
         futures = []
+        # checked before submitting, so a rerun with every file present starts no threads or cloud clients
+        downloaded = []
         for vcf_file in manifest.vcf_files:
-            if vcf_file.startswith("http"):
-                futures.append(
-                    executor.submit(
-                        download_http_file, vcf_file, manifest.work_directory
-                    )
-                )
-            elif vcf_file.startswith("gs://"):
-                bucket_name, blob_name = vcf_file[5:].split("/", 1)
-                destination_file_name = os.path.join(manifest.work_directory, blob_name)
-                futures.append(
-                    executor.submit(
-                        download_google_blob,
-                        bucket_name,
-                        blob_name,
-                        destination_file_name,
-                    )
-                )
-            elif vcf_file.startswith("s3://"):
-                bucket_name, object_name = vcf_file[5:].split("/", 1)
-                destination_file_name = os.path.join(
-                    manifest.work_directory, object_name
-                )
-                futures.append(
-                    executor.submit(
-                        download_s3_object,
-                        bucket_name,
-                        object_name,
-                        destination_file_name,
-                    )
-                )
-            elif vcf_file.startswith("file://"):
-                futures.append(
-                    executor.submit(
-                        create_symlink_to_work_directory,
-                        manifest.work_directory,
-                        vcf_file[7:],
-                    )
-                )
-            else:
-                futures.append(
-                    executor.submit(
-                        create_symlink_to_work_directory,
-                        manifest.work_directory,
-                        vcf_file,
-                    )
-                )
+            scheme, separator, path = vcf_file.partition("://")
+            task = _scheme_tasks.get(scheme) if separator else None
+            if task is None:
+                task, path = _local_task, vcf_file
+            destination_file_name, fn, args = task(
+                vcf_file, path, manifest.work_directory
+            )
+            if destination_file_name and _already_downloaded(destination_file_name):
+                downloaded.append(destination_file_name)
+                continue
+            futures.append(executor.submit(fn, *args))
+        # downloads are all submitted before the files already present are yielded
+        yield from downloaded
         # Yield results as they become available
         for _ in as_completed(futures):
             yield _.result()
@@ -1,48 +1,25 @@
+import collections
+import itertools
 import logging
-import queue
+import multiprocessing
 import threading
-from dataclasses import dataclass, field
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from logging.handlers import QueueHandler, QueueListener
 from typing import NamedTuple, Generator, Any, Optional
 
 from pydantic import BaseModel
 
-from vrs_anvil import caching_allele_translator_factory
+import vrs_anvil
+from vrs_anvil import LOGGED_ALREADY, caching_allele_translator_factory
 
 _logger = logging.getLogger("vrs_anvil.translator")
 
-
-class WorkerThread(threading.Thread):
-    """Read from the task queue, process the item, with local translator and write the result to the result queue."""
-
-    def __init__(self, task_queue, result_queue, normalize):
-        super().__init__(daemon=True)
-        self.task_queue = task_queue
-        self.result_queue = result_queue
-        self.translator = caching_allele_translator_factory(normalize=normalize)
-        self.busy = False
-
-    def run(self):
-        while True:
-            try:
-                prioritized_item = self.task_queue.get()
-                item: VCFItem = prioritized_item.item
-                if item is None:
-                    break  # Signal to exit the thread
-
-                self.busy = True
-                allele_id = self.translator.translate_from(fmt=item.fmt, var=item.var)
-                _ = item._asdict()
-                _["result"] = allele_id
-                result = VCFItem(**_)
-                self.result_queue.put(PrioritizedItem(1, result))
-
-                self.busy = False
-                self.task_queue.task_done()
-
-            except Exception as exc:
-                _logger.exception(f"{self.name} error {exc}")
-                self.busy = False
-                break
+batch_size = 1024  # items sent to a worker process per task
 
 
 class VCFItem(NamedTuple):
@@ -60,40 +37,80 @@ class VCFItem(NamedTuple):
     """identifier for the item"""
     result: Any = None
     """identifier for the item"""
-
-
-@dataclass(order=True)
-class PrioritizedItem:
-    """If the data elements are not comparable, the data can be wrapped in a class that ignores the data item and only compares the priority number"""
-
-    priority: int
-    item: Any = field(compare=False)
+    error: str = None
+    """why the item could not be translated, result is None when set"""
 
 
 class Translator(BaseModel):
     """A class to run the translation in either threaded or non-threaded fashion."""
 
     normalize: Optional[bool] = False
+    use_processes: Optional[bool] = False
 
     def translate_from(
         self, generator: Generator[VCFItem, None, None], num_threads: int = 8
     ) -> Generator[VCFItem, None, None]:
-        if num_threads > 1:
+        if num_threads > 1 and self.use_processes:
+            return pooled_translator(generator, num_threads, self.normalize)
+        elif num_threads > 1:
             return threaded_translator(generator, num_threads, self.normalize)
         else:
             return inline_translator(generator, self.normalize)
 
 
+def _error_message(exc: Exception) -> str:
+    """Return the error recorded on an item that failed to translate."""
+    return f"{type(exc).__name__}: {exc}"
+
+
+def _log_error(exc: Exception) -> str:
+    """Log a failed translation and return its error, identical errors are logged once, with the traceback when debugging."""
+    message = _error_message(exc)
+    if message not in LOGGED_ALREADY:
+        LOGGED_ALREADY.add(message)
+        _logger.error(
+            "translation error %s",
+            message,
+            exc_info=exc if _logger.isEnabledFor(logging.DEBUG) else None,
+        )
+    return message
+
+
+def _translate_item(translator, item: VCFItem) -> VCFItem:
+    """Translate a single item, a failure is returned on the item rather than raised."""
+    try:
+        allele_id = translator.translate_from(fmt=item.fmt, var=item.var)
+    except Exception as exc:
+        return item._replace(error=_log_error(exc))
+    return item._replace(result=allele_id)
+
+
+_tls = threading.local()
+"""Holds each thread's translator, see _get_translator."""
+
+
+def _get_translator(normalize: bool):
+    """Return this thread's translator, it is built on first use and reused by later translations
+    while normalize and the manifest settings the factory reads are unchanged."""
+    manifest = vrs_anvil.manifest
+    key = (normalize,) + (
+        (manifest.seqrepo_directory, manifest.cache_enabled, manifest.cache_directory)
+        if manifest
+        else ()
+    )
+    if getattr(_tls, "key", None) != key:
+        _tls.translator = caching_allele_translator_factory(normalize=normalize)
+        _tls.key = key
+    return _tls.translator
+
+
 def inline_translator(
     generator: Generator[VCFItem, None, None], normalize: bool = False
 ) -> Generator[VCFItem, None, None]:
     """A generator that runs the translation in a non-threaded fashion."""
-    tlr = caching_allele_translator_factory(normalize=normalize)
+    tlr = _get_translator(normalize)
     for item in generator:
-        allele_id = tlr.translate_from(fmt=item.fmt, var=item.var)
-        _ = item._asdict()
-        _["result"] = allele_id
-        yield VCFItem(**_)
+        yield _translate_item(tlr, item)
 
 
 def threaded_translator(
@@ -101,50 +118,108 @@ def threaded_translator(
     num_worker_threads: int,
     normalize: bool = False,
 ) -> Generator[VCFItem, None, None]:
-    """A generator that runs the translation in a threaded fashion."""
-    task_queue = queue.PriorityQueue(maxsize=num_worker_threads * 2)
-    result_queue = queue.PriorityQueue(maxsize=num_worker_threads * 2)
-
-    # Start worker threads
-    worker_threads = [
-        WorkerThread(task_queue, result_queue, normalize)
-        for _ in range(num_worker_threads)
+    """A generator that runs the translation in a pool of threads, results are yielded in input order."""
+
+    def _translate(item: VCFItem) -> VCFItem:
+        return _translate_item(_get_translator(normalize), item)
+
+    # a bounded window of pending items, Executor.map would read the whole generator up front
+    with ThreadPoolExecutor(max_workers=num_worker_threads) as executor:
+        pending = collections.deque()
+        for item in generator:
+            pending.append(executor.submit(_translate, item))
+            if len(pending) >= num_worker_threads * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+_worker_translator = None
+"""The translator used by a pooled_translator worker process."""
+_worker_normalize = False
+
+
+def _pool_initializer(manifest, normalize: bool, log_queue, log_level: int):
+    """Set up the worker process with the parent's manifest, log records are queued back to the parent."""
+    global _worker_normalize
+    vrs_anvil.manifest = manifest
+    _worker_normalize = normalize
+    root_logger = logging.getLogger()
+    root_logger.handlers = [QueueHandler(log_queue)]
+    root_logger.setLevel(log_level)
+
+
+def _process_batch(batch: list[VCFItem]) -> list[VCFItem]:
+    """Translate a batch of items in a worker process."""
+    global _worker_translator
+    # built on first use rather than in the initializer, a failing initializer breaks the whole pool
+    if _worker_translator is None:
+        _worker_translator = caching_allele_translator_factory(
+            normalize=_worker_normalize
+        )
+    fmt = batch[0].fmt
+    if not all(item.fmt == fmt for item in batch):
+        return [_translate_item(_worker_translator, item) for item in batch]
+    allele_ids = _worker_translator.translate_from_many(
+        [item.var for item in batch], fmt=fmt, return_exceptions=True
+    )
+    return [
+        (
+            item._replace(error=_log_error(allele_id))
+            if isinstance(allele_id, Exception)
+            else item._replace(result=allele_id)
+        )
+        for item, allele_id in zip(batch, allele_ids)
     ]
-    for worker_thread in worker_threads:
-        worker_thread.start()
 
-    # Start the reader thread
 
-    def reader_thread(_generator):
-        for item in _generator:
-            task_queue.put(PrioritizedItem(1, item))  # Default priority is 1
+def _chunk(generator: Generator[VCFItem, None, None], n: int):
+    """Yield lists of up to n items from the generator."""
+    while batch := list(itertools.islice(generator, n)):
+        yield batch
 
-    reader = threading.Thread(target=reader_thread, args=(generator,), daemon=True)
-    reader.start()
 
-    # Main thread yields results
-    logged_already = []
-    c = 0
-    while True:
+def pooled_translator(
+    generator: Generator[VCFItem, None, None],
+    num_workers: int,
+    normalize: bool = False,
+) -> Generator[VCFItem, None, None]:
+    """A generator that runs the translation in a pool of processes, batches of results are yielded as completed."""
+    # not fork, this process has other threads running (the log listener, tqdm's monitor) and forking it may deadlock
+    context = multiprocessing.get_context("forkserver")
+    # worker log records are handled by this process's root handlers, so they reach the same log file
+    log_queue = context.Queue()
+    root_logger = logging.getLogger()
+    listener = QueueListener(
+        log_queue, *root_logger.handlers, respect_handler_level=True
+    )
+    listener.start()
+    try:
+        executor = ProcessPoolExecutor(
+            num_workers,
+            mp_context=context,
+            initializer=_pool_initializer,
+            initargs=(
+                vrs_anvil.manifest,
+                normalize,
+                log_queue,
+                root_logger.getEffectiveLevel(),
+            ),
+        )
         try:
-            prioritized_item = result_queue.get(
-                timeout=1
-            )  # Give the thread time to start
-            c += 1
-            yield prioritized_item.item
-            result_queue.task_done()
-        except queue.Empty:
-            reader_started = c > 0
-            if reader_started and all(
-                not worker_thread.busy for worker_thread in worker_threads
-            ):
-                _logger.info("All worker threads are idle, exiting.")
-                break
-            if not reader_started:
-                msg = "queue.Empty - Waiting for reader to start"
-            else:
-                msg = "queue.Empty - Waiting for worker threads to finish"
-
-            if msg not in logged_already:
-                _logger.info(msg)
-                logged_already.append(msg)
+            batches = _chunk(iter(generator), batch_size)
+            pending = set()
+            while True:
+                # two batches per worker keep them busy without reading the whole vcf ahead
+                for batch in itertools.islice(batches, 2 * num_workers - len(pending)):
+                    pending.add(executor.submit(_process_batch, batch))
+                if not pending:
+                    break
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+        finally:
+            # when the caller stops early, queued batches are dropped and running ones finish, no worker is terminated
+            executor.shutdown(cancel_futures=True)
+    finally:
+        listener.stop()